@@ -0,0 +1,243 @@
+from datetime import datetime, timezone
+import argparse
+import csv
+import gzip
+import importlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Start a new segment file once the current one grows past this size
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+def archive_directory(store_name, date, root='archive'):
+    # date is formatted as in the output filenames, e.g. 20241031
+    return os.path.join(root, store_name, date)
+
+
+def segment_filename(directory, number):
+    return os.path.join(directory, f'segment-{number:05d}.warc.gz')
+
+
+def list_segments(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith('segment-') and name.endswith('.warc.gz')
+    )
+
+
+def read_index(directory):
+    # Return the (url, segment, offset, length) entries of index.tsv that point at
+    # complete records. A crash can leave a partial last line or a line pointing past
+    # the end of its segment; both are skipped
+    path = os.path.join(directory, 'index.tsv')
+    if not os.path.exists(path):
+        return []
+    sizes = {}
+    entries = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.endswith('\n'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 4 or not fields[2].isdigit() or not fields[3].isdigit():
+                continue
+            url, segment, offset, length = fields[0], fields[1], int(fields[2]), int(fields[3])
+            if segment not in sizes:
+                segment_path = os.path.join(directory, segment)
+                sizes[segment] = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+            if offset + length <= sizes[segment]:
+                entries.append((url, segment, offset, length))
+    return entries
+
+
+class ArchiveWriter:
+    # Appends raw response bodies to WARC-style segment files. Every record is its own
+    # gzip member, so index.tsv can point straight at it by segment, offset and length
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Keep appending to the last segment when a run is resumed
+        segments = list_segments(directory)
+        self.segment_number = len(segments) - 1 if segments else 0
+        self.recover()
+        self.segment = open(segment_filename(directory, self.segment_number), 'ab')
+        self.index = open(os.path.join(directory, 'index.tsv'), 'a', encoding='utf-8')
+
+    def recover(self):
+        # Records are flushed before their index line, so after a crash the last segment
+        # may end in a record that was never indexed, or only partly written. Cut it back
+        # to the end of its last indexed record and drop index lines that are incomplete
+        index_path = os.path.join(self.directory, 'index.tsv')
+        segment_path = segment_filename(self.directory, self.segment_number)
+        entries = read_index(self.directory)
+        segment = os.path.basename(segment_path)
+        end = max((offset + length for _, name, offset, length in entries if name == segment), default=0)
+        if os.path.exists(segment_path) and os.path.getsize(segment_path) > end:
+            logging.warning(f'Truncating {segment_path} to its last indexed record at {end} bytes')
+            os.truncate(segment_path, end)
+
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as file:
+                n_lines = sum(1 for _ in file)
+            if n_lines != len(entries):
+                logging.warning(f'Dropping {n_lines - len(entries)} incomplete lines from {index_path}')
+                with open(index_path, 'w', encoding='utf-8') as file:
+                    file.writelines('\t'.join(map(str, entry)) + '\n' for entry in entries)
+
+    def write(self, url, content):
+        warc_date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        header = (
+            'WARC/1.0\r\n'
+            'WARC-Type: response\r\n'
+            f'WARC-Target-URI: {url}\r\n'
+            f'WARC-Date: {warc_date}\r\n'
+            f'Content-Length: {len(content)}\r\n'
+            '\r\n'
+        ).encode('utf-8')
+        record = gzip.compress(header + content + b'\r\n\r\n')
+
+        with self.lock:
+            offset = self.segment.tell()
+            if offset and offset + len(record) > self.segment_size:
+                self.segment.close()
+                self.segment_number += 1
+                self.segment = open(segment_filename(self.directory, self.segment_number), 'ab')
+                offset = 0
+            # The record reaches the segment before the index points at it
+            self.segment.write(record)
+            self.segment.flush()
+            self.index.write(f'{url}\t{os.path.basename(self.segment.name)}\t{offset}\t{len(record)}\n')
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            self.segment.close()
+            self.index.close()
+
+
+def parse_record(data):
+    # Split a decompressed record into its headers and body
+    head, _, rest = data.partition(b'\r\n\r\n')
+    headers = dict(
+        line.split(': ', 1) for line in head.decode('utf-8').split('\r\n')[1:] if ': ' in line
+    )
+    return headers, rest[:int(headers['Content-Length'])]
+
+
+def read_record(directory, url):
+    # Random access to the latest archived response for a URL through the index
+    location = None
+    for indexed_url, segment, offset, length in read_index(directory):
+        if indexed_url == url:
+            location = segment, offset, length
+    if location is None:
+        return None
+    segment, offset, length = location
+    with open(os.path.join(directory, segment), 'rb') as file:
+        file.seek(offset)
+        _, content = parse_record(gzip.decompress(file.read(length)))
+    return content
+
+
+def reparse_chunk(store_name, directory, locations, scrape_date):
+    # Runs in a worker process: re-extract the pages at the given (url, segment, offset, length)
+    # locations, sorted by segment and offset. A damaged record only loses that page
+    store = importlib.import_module(store_name)
+    records = []
+    file = None
+    try:
+        for url, segment, offset, length in locations:
+            path = os.path.join(directory, segment)
+            if file is None or file.name != path:
+                if file:
+                    file.close()
+                file = open(path, 'rb')
+            try:
+                file.seek(offset)
+                _, content = parse_record(gzip.decompress(file.read(length)))
+                record = store.parse_product_page(url, content)
+            except Exception as e:
+                logging.error(f'Error parsing {url} from {path} at offset {offset}: {e}')
+                continue
+            record.scrape_date = scrape_date
+            records.append(record)
+    finally:
+        if file:
+            file.close()
+    return records
+
+
+def reparse(store_name, date, output_filename, root='archive', max_workers=None):
+    # Rebuild a day's CSV from the archive without any network requests
+    store = importlib.import_module(store_name)
+    directory = archive_directory(store_name, date, root)
+    scrape_date = datetime.strptime(date, '%Y%m%d').strftime('%Y-%m-%d')
+    if not os.path.isdir(directory):
+        logging.error(f'No archive found in {directory}')
+        return
+
+    # Records are read through the index, so bytes a crash left after the last indexed
+    # record are never parsed. A URL fetched more than once keeps its latest response
+    latest = {}
+    for url, segment, offset, length in read_index(directory):
+        latest[url] = segment, offset, length
+    locations = sorted(
+        ((url, segment, offset, length) for url, (segment, offset, length) in latest.items()),
+        key=lambda location: (location[1], location[2])
+    )
+
+    # Segments only roll over at SEGMENT_SIZE, so a day is usually one or two of them.
+    # Split the records into a few chunks per core instead, whichever segment they are in
+    n_workers = max_workers or os.cpu_count() or 1
+    chunk_size = max(-(-len(locations) // (n_workers * 4)), 1)
+    chunks = [locations[start:start + chunk_size] for start in range(0, len(locations), chunk_size)]
+
+    with open(output_filename, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=store.FIELDNAMES)
+        writer.writeheader()
+
+    n_products = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(reparse_chunk, store_name, directory, chunk, scrape_date) for chunk in chunks]
+        for future in futures:
+            records = future.result()
+            n_products += len(records)
+            if records:
+                store.save_batch_data(records, output_filename)
+    logging.info(
+        f'Reparsed {n_products} of {len(latest)} indexed products in {len(chunks)} chunks into {output_filename}'
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rebuild a CSV from archived responses')
+    parser.add_argument('command', choices=['reparse'])
+    parser.add_argument('store', choices=['atb', 'metro', 'novus', 'ekomarket'])
+    parser.add_argument('date', help='Scrape date as in the output filename, e.g. 20241031')
+    parser.add_argument('--output', help='Output CSV (default: <store><date>_reparsed.csv)')
+    parser.add_argument('--archive-root', default='archive')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='Overwrite the output CSV if it exists')
+    args = parser.parse_args()
+
+    # Never replace the scraped CSV by accident
+    output_filename = args.output or f'{args.store}{args.date}_reparsed.csv'
+    if os.path.exists(output_filename) and not args.force:
+        parser.error(f'{output_filename} already exists, pass --force to overwrite it')
+
+    start_time = time.time()
+    reparse(args.store, args.date, output_filename, args.archive_root, args.processes)
+    end_time = time.time()
+    logging.info(f'Reparse completed in {end_time - start_time:.2f} seconds')
@@ -1,24 +1,42 @@
-import cloudscraper
 import requests
 from bs4 import BeautifulSoup
-import pandas as pd
 from datetime import datetime
 import csv
 import logging
 import time
 import os
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from product import ProductRecord, Stock, parse_price, parse_weight
 
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Create a cloudscraper instance
-scraper = cloudscraper.create_scraper()
+SITEMAP_URL = 'https://www.atbmarket.com/sitemap_products.xml'
+
+# The cloudscraper instance is created on first use, so importing this module stays cheap
+scraper = None
+scraper_lock = threading.Lock()
+
+# Base output columns; characteristics requested via `characteristic_columns` are appended after them
+FIELDNAMES = [
+    'url', 'title', 'weight', 'weight_unit', 'stock', 'old_price', 'discounted_price',
+    'unit_price', 'trademark', 'price_unit', 'origin_country', 'scrape_date'
+]
+
+def get_scraper():
+    global scraper
+    with scraper_lock:
+        if scraper is None:
+            import cloudscraper
+            scraper = cloudscraper.create_scraper()
+    return scraper
+
 
 def fetch_sitemap(url):
     try:
-        response = scraper.get(url)
+        response = get_scraper().get(url)
         # response = requests.get(url)
         response.raise_for_status()
         return response.content
@@ -33,7 +51,101 @@ def parse_sitemap(xml_content):
     return urls
 
 
-def scrape_product_info(url):
+def iter_sitemap_urls(url):
+    # Yield the sitemap URLs one at a time without holding the whole document in memory
+    from memory import stream_sitemap
+    return stream_sitemap(get_scraper().get, url)
+
+
+def extract_characteristics(soup):
+    # Map every characteristic name to its value in a single pass over the table
+    characteristics = {}
+    for item in soup.find_all('div', class_='product-characteristics__item'):
+        name_element = item.find('div', class_='product-characteristics__name')
+        value_element = item.find('div', class_='product-characteristics__value')
+        if name_element and value_element:
+            name = name_element.get_text().strip()
+            if name and name not in characteristics:
+                characteristics[name] = value_element.get_text().strip()
+    return characteristics
+
+
+def parse_product_page(url, content, characteristic_columns=None):
+    soup = BeautifulSoup(content, 'html.parser')
+    
+    # Extract the title
+    title_element = soup.find('h1', {'class': 'page-title'})
+    title = title_element.get_text().strip() if title_element else None
+
+    # Extract the price unit
+    price_unit_element = soup.find('span', {'class': 'product-price__unit'})
+    price_unit = price_unit_element.get_text().replace('/', '').strip() if price_unit_element else None
+
+    # Read the whole product characteristics table in one pass
+    characteristics = extract_characteristics(soup)
+
+    # Extract the weight, prioritizing "Вага" over "Об’єм"
+    weight, weight_unit = parse_weight(characteristics.get('Вага') or characteristics.get('Об’єм'))
+
+    # Extract the trademark and the origin country
+    trademark = characteristics.get('Торгова марка')
+    origin_country = characteristics.get('Країна')
+
+    # Extract the stock status
+    stock_element = soup.find('span', {'class': 'available-tag__text'})
+    stock_text = stock_element.get_text().strip() if stock_element else None
+    stock = Stock.OUT
+    if stock_text == 'Є в наявності':
+        stock = Stock.IN
+    elif stock_text == 'Закінчується':
+        stock = Stock.LOW # or 'very low'?
+
+    # Extract the prices
+    product_price_div = soup.find('div', class_='product-about__price')
+    # Initialize prices
+    discounted_price = None
+    old_price = None
+    if product_price_div:
+        # Check for the presence of product-price__bottom for old price
+        old_price_element = product_price_div.find('data', {'class': 'product-price__bottom'})
+        if old_price_element:
+            # Extract old price from product-price__bottom
+            old_price_span = old_price_element.find('span')
+            old_price = old_price_span.get_text() if old_price_span else None
+            
+            # Extract discounted price from product-price__top
+            discounted_price_element = product_price_div.find('data', {'class': 'product-price__top'})
+            discounted_price_span = discounted_price_element.find('span') if discounted_price_element else None
+            discounted_price = discounted_price_span.get_text() if discounted_price_span else None
+        else:
+            # If no discounted price, treat product-price__top as old price
+            old_price_element = product_price_div.find('data', {'class': 'product-price__top'})
+            old_price_span = old_price_element.find('span') if old_price_element else None
+            old_price = old_price_span.get_text() if old_price_span else None
+
+    # Release the parse tree right away instead of waiting for the garbage collector
+    soup.decompose()
+
+    # Return the normalised product record
+    return ProductRecord(
+        url,
+        title=title,
+        weight=weight,
+        weight_unit=weight_unit,
+        stock=stock,
+        old_price=parse_price(old_price),
+        discounted_price=parse_price(discounted_price),
+        price_unit=price_unit,
+        trademark=trademark,
+        origin_country=origin_country,
+        # Only the characteristics written as their own columns are kept on the buffered record
+        characteristics={
+            name: characteristics[name] for name in characteristic_columns if name in characteristics
+        } if characteristic_columns else None
+    )
+
+
+def scrape_product_info(url, archive=None, characteristic_columns=None):
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
@@ -43,100 +155,12 @@ def scrape_product_info(url):
     while tries < max_tries:
         tries += 1
         try:
-            response = scraper.get(url, headers=headers)
+            response = get_scraper().get(url, headers=headers)
             # response = requests.get(url, headers=headers)
             response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Extract the title
-            title_element = soup.find('h1', {'class': 'page-title'})
-            title = title_element.get_text() if title_element else None
-
-            # Extract the price unit
-            price_unit_element = soup.find('span', {'class': 'product-price__unit'})
-            price_unit = price_unit_element.get_text().replace('/', '').strip() if price_unit_element else None
-
-            # Find the product characteristics table for 'weight', 'trademark', and 'origin country'
-            characteristic_items = soup.find_all('div', class_='product-characteristics__item')
-
-            # Extract the weight
-            weight = None
-            for item in characteristic_items:
-                name_element = item.find('div', class_='product-characteristics__name')
-                if name_element:
-                    name_text = name_element.get_text()
-                    value_element = item.find('div', class_='product-characteristics__value')
-                    if value_element:
-                        value_text = value_element.get_text()
-                        if name_text == 'Вага':
-                            weight = value_text
-                            break  # Prioritize "Вага" and exit loop
-                        elif name_text == "Об’єм" and weight is None:
-                            weight = value_text
-
-            # Extract the trademark
-            trademark = None
-            for item in characteristic_items:
-                name_element = item.find('div', class_='product-characteristics__name')
-                if name_element and name_element.get_text() == 'Торгова марка':
-                    value_element = item.find('div', class_='product-characteristics__value')
-                    if value_element and value_element.a:
-                        trademark = value_element.a.get_text()
-                    break
-
-            # Extract the origin country
-            origin_country = None
-            for item in characteristic_items:
-                name_element = item.find('div', class_='product-characteristics__name')
-                if name_element and name_element.get_text() == 'Країна':
-                    value_element = item.find('div', class_='product-characteristics__value')
-                    if value_element:
-                        origin_country = value_element.get_text()
-                    break
-
-            # Extract the stock status
-            stock_element = soup.find('span', {'class': 'available-tag__text'}).get_text()
-            stock = 'out'
-            if stock_element == 'Є в наявності':
-                stock = 'in'
-            elif stock_element == 'Закінчується':
-                stock = 'low' # or 'very low'?
-
-            # Extract the prices
-            product_price_div = soup.find('div', class_='product-about__price')
-            # Initialize prices
-            discounted_price = None
-            old_price = None
-            if product_price_div:
-                # Check for the presence of product-price__bottom for old price
-                old_price_element = product_price_div.find('data', {'class': 'product-price__bottom'})
-                if old_price_element:
-                    # Extract old price from product-price__bottom
-                    old_price_span = old_price_element.find('span')
-                    old_price = old_price_span.get_text() if old_price_span else None
-                    
-                    # Extract discounted price from product-price__top
-                    discounted_price_element = product_price_div.find('data', {'class': 'product-price__top'})
-                    discounted_price_span = discounted_price_element.find('span') if discounted_price_element else None
-                    discounted_price = discounted_price_span.get_text() if discounted_price_span else None
-                else:
-                    # If no discounted price, treat product-price__top as old price
-                    old_price_element = product_price_div.find('data', {'class': 'product-price__top'})
-                    old_price_span = old_price_element.find('span') if old_price_element else None
-                    old_price = old_price_span.get_text() if old_price_span else None
-
-            # Return the data as a dictionary
-            return {
-                'url': url,
-                'title': title,
-                'weight': weight,
-                'stock': stock,
-                'old_price': old_price,
-                'discounted_price': discounted_price,
-                'price_unit': price_unit,
-                'trademark': trademark,
-                'origin_country': origin_country
-            }
+            if archive:
+                archive.write(url, response.content)
+            return parse_product_page(url, response.content, characteristic_columns)
         except requests.RequestException as e:
             logging.error(f'Attempt {tries} failed to retrieve the page: {url} - {e}')
             if tries == max_tries:
@@ -146,27 +170,43 @@ def scrape_product_info(url):
 
 def get_processed_urls(output_filename):
     if os.path.exists(output_filename):
-        df = pd.read_csv(output_filename)
-        logging.debug(f'Columns in the output file: {df.columns.tolist()}')
-        if 'url' in df.columns:
-            return set(df['url'])
-        else:
-            logging.error(f'url column not found in {output_filename}')
-            return set()
+        with open(output_filename, newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            logging.debug(f'Columns in the output file: {reader.fieldnames}')
+            if reader.fieldnames and 'url' in reader.fieldnames:
+                return {row['url'] for row in reader}
+            else:
+                logging.error(f'url column not found in {output_filename}')
+                return set()
     return set()
 
 
-def save_batch_data(batch_data, output_filename):
+def get_output_fieldnames(output_filename, characteristic_columns=None):
+    # Keep appending with the existing header so resumed runs stay aligned
+    if os.path.exists(output_filename):
+        with open(output_filename, newline='', encoding='utf-8') as file:
+            header = next(csv.reader(file), None)
+        if header:
+            return header
+    return FIELDNAMES + [column for column in characteristic_columns or [] if column not in FIELDNAMES]
+
+
+def save_batch_data(batch_data, output_filename, fieldnames=FIELDNAMES):
     with open(output_filename, mode='a', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=[
-            'url', 'title', 'weight', 'stock', 'old_price', 'discounted_price', 
-            'trademark', 'price_unit', 'origin_country', 'scrape_date'
-        ])
-        writer.writerows(batch_data)
+        writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
+        for record in batch_data:
+            # Expose the requested characteristics as their own columns
+            row = record.as_row()
+            characteristics = record.characteristics or {}
+            for column in fieldnames:
+                if column not in row:
+                    row[column] = characteristics.get(column)
+            writer.writerow(row)
     logging.info(f'Saved a batch of {len(batch_data)} products to {output_filename}')
 
 
-def scrape_all_products(sitemap_url, output_filename, max_workers=5):
+def scrape_all_products(sitemap_url, output_filename, max_workers=5, characteristic_columns=None,
+                        scheduler=None, budget=None, archive=None):
     sitemap_content = fetch_sitemap(sitemap_url)
     if sitemap_content:
         urls = parse_sitemap(sitemap_content)
@@ -175,24 +215,37 @@ def scrape_all_products(sitemap_url, output_filename, max_workers=5):
         total_urls = len(urls)
         remaining_urls = [url for url in urls if url not in processed_urls]
 
+        # Refresh volatile products first, within the request budget; rows already in
+        # the output file were scraped by an earlier leg of this run and count against it
+        if scheduler:
+            n_remaining = len(remaining_urls)
+            if budget is not None:
+                budget = max(budget - len(processed_urls), 0)
+            remaining_urls = scheduler.order(remaining_urls, budget)
+            total_urls -= n_remaining - len(remaining_urls)
+
         # Record the number of total urls to a separate file (for server running purposes)
         with open("n_rows_atb.txt", 'w') as f:
             f.write(str(total_urls))
 
         # Initialize the CSV file with headers if starting from scratch
+        fieldnames = get_output_fieldnames(output_filename, characteristic_columns)
+        # A resumed run takes its characteristic columns from the existing header
+        characteristic_columns = [column for column in fieldnames if column not in FIELDNAMES]
         if not os.path.exists(output_filename):
             with open(output_filename, mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=[
-                    'url', 'title', 'weight', 'stock', 'old_price', 'discounted_price', 
-                    'trademark', 'price_unit', 'origin_country', 'scrape_date'
-                ])
+                writer = csv.DictWriter(file, fieldnames=fieldnames)
                 writer.writeheader()
 
         batch_size = 25
         batch_data = []
+        scrape_date = datetime.now().strftime('%Y-%m-%d')
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {executor.submit(scrape_product_info, url): url for url in remaining_urls}
+            future_to_url = {
+                executor.submit(scrape_product_info, url, archive, characteristic_columns): url
+                for url in remaining_urls
+            }
             completed_urls = len(processed_urls)
 
             for future in as_completed(future_to_url):
@@ -200,12 +253,14 @@ def scrape_all_products(sitemap_url, output_filename, max_workers=5):
                 try:
                     data = future.result()
                     if data:
-                        data['scrape_date'] = datetime.now().strftime('%Y-%m-%d')
+                        data.scrape_date = scrape_date
                         batch_data.append(data)
                         processed_urls.add(url)
                         completed_urls += 1
                         if len(batch_data) >= batch_size:
-                            save_batch_data(batch_data, output_filename)
+                            save_batch_data(batch_data, output_filename, fieldnames)
+                            if scheduler:
+                                scheduler.observe(batch_data)
                             batch_data.clear()
                     progress = (completed_urls / total_urls) * 100
                     logging.info(f'Progress: {progress:.2f}% ({completed_urls}/{total_urls})')
@@ -214,11 +269,12 @@ def scrape_all_products(sitemap_url, output_filename, max_workers=5):
 
         # Save any remaining data in the last batch
         if batch_data:
-            save_batch_data(batch_data, output_filename)
+            save_batch_data(batch_data, output_filename, fieldnames)
+            if scheduler:
+                scheduler.observe(batch_data)
 
 
 if __name__ == "__main__":
-    SITEMAP_URL = 'https://www.atbmarket.com/sitemap_products.xml'
     current_date = datetime.now().strftime('%Y%m%d')
     OUTPUT_FILENAME = f'atb{current_date}.csv'
     
@@ -0,0 +1,64 @@
+import subprocess
+import sys
+
+
+# Startup regression check: imports each entry module in a fresh interpreter and fails
+# when it takes longer than its budget or pulls in a dependency that must stay lazy.
+# Run with `python bench_startup.py`; exits with status 1 on a regression.
+
+# Budgets are multiples of the time this machine takes to import a fixed set of standard
+# library modules, measured in the same run, so a slow VPS or a busy CI runner scales both.
+# When they were set the baseline was ~40-50 ms, cli ~0.4x and the stores ~4-5x. The budgets
+# leave about twice that for noise and only catch gross slowdowns; a dependency that should
+# stay lazy is caught by the LAZY_MODULES check instead
+BASELINE = 'http.client, email.parser, decimal, xml.etree.ElementTree, argparse, logging, csv'
+BUDGETS = {
+    'cli': 1.5,
+    'atb': 10,
+    'metro': 10,
+    'novus': 10,
+    'ekomarket': 10,
+}
+LAZY_MODULES = ['pandas', 'cloudscraper', 'memory']
+REPEAT = 5
+
+MEASURE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(elapsed)
+print(','.join(name for name in {lazy_modules!r} if name in sys.modules))
+'''
+
+
+def measure(module):
+    # Best of REPEAT runs, so a busy machine does not cause false alarms
+    best = None
+    loaded = set()
+    for _ in range(REPEAT):
+        output = subprocess.run(
+            [sys.executable, '-c', MEASURE.format(module=module, lazy_modules=LAZY_MODULES)],
+            capture_output=True, text=True, check=True
+        ).stdout.splitlines()
+        elapsed = float(output[0])
+        best = elapsed if best is None else min(best, elapsed)
+        loaded.update(name for name in output[1].split(',') if name)
+    return best, loaded
+
+
+if __name__ == "__main__":
+    failed = False
+    baseline, _ = measure(BASELINE)
+    print(f'{"baseline":<10} {baseline:8.1f} ms')
+    for module, budget in BUDGETS.items():
+        elapsed, loaded = measure(module)
+        status = 'ok'
+        if elapsed > budget * baseline:
+            status = f'SLOW (budget {budget}x baseline = {budget * baseline:.0f} ms)'
+            failed = True
+        if loaded:
+            status = f'imports {", ".join(sorted(loaded))} at startup'
+            failed = True
+        print(f'{module:<10} {elapsed:8.1f} ms  {elapsed / baseline:5.1f}x  {status}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,77 @@
+import sys
+from product import ProductRecord, Stock, parse_price, parse_weight
+
+
+# Checks for the price and weight parsers and unit prices every store relies on.
+# Run with `python check_product.py`; exits with status 1 if a case fails.
+
+PRICE_CASES = [
+    ('1 052,90 грн', 105290),
+    ('1\xa0052,90 грн', 105290),
+    ('52.90', 5290),
+    ('0,99', 99),
+    ('500 грн', 50000),
+    ('грн', None),
+    ('', None),
+    (None, None),
+]
+
+WEIGHT_CASES = [
+    ('500 г', (500, 'g')),
+    ('100 гр', (100, 'g')),
+    ('Гречка 900г', (900, 'g')),
+    ('1,5 кг', (1500, 'g')),
+    ('0,125 кг', (125, 'g')),
+    ('4 x 100 г', (400, 'g')),
+    ('4х100г', (400, 'g')),
+    ('0,75 L', (750, 'ml')),
+    ('0.33л', (330, 'ml')),
+    ('330 мл', (330, 'ml')),
+    ('2 шт', (2, 'pcs')),
+    ('0,5 kg', (500, 'g')),
+    # A unit must not be the start of a longer word
+    ('500 грн', (None, None)),
+    ('5 літрів', (None, None)),
+    ('без ваги', (None, None)),
+    (None, (None, None)),
+]
+
+UNIT_PRICE_CASES = [
+    # Sold by weight: the price already is per kg
+    (ProductRecord('a', old_price=12990, price_unit='кг'), 12990),
+    (ProductRecord('b', weight=500, weight_unit='g', old_price=5000), 10000),
+    (ProductRecord('c', weight=750, weight_unit='ml', old_price=9000), 12000),
+    (ProductRecord('d', weight=10, weight_unit='pcs', old_price=5000), 500),
+    # The discounted price is what a customer pays
+    (ProductRecord('e', weight=1000, weight_unit='g', old_price=5000, discounted_price=4000), 4000),
+    (ProductRecord('f', old_price=5000), None),
+    (ProductRecord('g', weight=500, weight_unit='g'), None),
+]
+
+
+def check():
+    errors = []
+
+    def expect(description, actual, expected):
+        if actual != expected:
+            errors.append(f'{description}: expected {expected!r}, got {actual!r}')
+
+    for text, expected in PRICE_CASES:
+        expect(f'parse_price({text!r})', parse_price(text), expected)
+    for text, expected in WEIGHT_CASES:
+        expect(f'parse_weight({text!r})', parse_weight(text), expected)
+    for record, expected in UNIT_PRICE_CASES:
+        expect(f'unit_price of {record!r}', record.unit_price, expected)
+
+    row = ProductRecord('h', title='Молоко', weight=900, weight_unit='ml', stock=Stock.LOW, old_price=4590).as_row()
+    expect('as_row stock', row['stock'], 'low')
+    expect('as_row unit_price', row['unit_price'], 5100)
+    return errors
+
+
+if __name__ == "__main__":
+    errors = check()
+    print('ok' if not errors else 'FAILED')
+    for error in errors:
+        print(f'  {error}')
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+import time
+from work_queue import MemoryRedis, RedisQueue, open_queue
+
+
+# Lease-expiry check for every queue backend, including the in-memory Redis stand-in.
+# Run with `python check_work_queue.py`; exits with status 1 if a backend misbehaves.
+
+LEASE_SECONDS = 0.2
+
+
+def check(spec):
+    errors = []
+
+    def expect(description, actual, expected):
+        if actual != expected:
+            errors.append(f'{description}: expected {expected!r}, got {actual!r}')
+
+    urls = ['http://example.com/1', 'http://example.com/2', 'http://example.com/3']
+    queue = open_queue(spec, name='check1', lease_seconds=LEASE_SECONDS)
+    expect('push', queue.push(urls), 3)
+    expect('push again in the same run', queue.push(urls), 0)
+
+    # Worker A leases two URLs and crashes without completing them
+    crashed = queue.lease('worker-a', 2)
+    expect('lease by worker A', len(crashed), 2)
+    remaining = queue.lease('worker-b', 5)
+    expect('lease by worker B', remaining, [url for url in urls if url not in crashed])
+    queue.complete(remaining)
+    expect('lease while A still holds its lease', queue.lease('worker-b', 5), [])
+
+    # Once A's lease expires, its URLs go back to the queue
+    time.sleep(LEASE_SECONDS * 1.5)
+    recovered = queue.lease('worker-b', 5)
+    expect('lease after expiry', sorted(recovered), sorted(crashed))
+    queue.complete(recovered)
+    expect('counts after completion', queue.counts(), {'pending': 0, 'leased': 0, 'done': 3, 'failed': 0})
+    queue.close()
+
+    # A new run starts from scratch
+    queue = open_queue(spec, name='check2', lease_seconds=LEASE_SECONDS, max_attempts=2)
+    expect('push in a new run', queue.push(urls[:1]), 1)
+
+    # A URL failing on every attempt ends up failed
+    for _ in range(5):
+        queue.fail(queue.lease('worker-a', 1))
+    expect('counts after repeated failures', queue.counts(), {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1})
+    queue.close()
+    return errors
+
+
+class InterleavingRedis(MemoryRedis):
+    # Runs a callback right after a worker's processing list has been drained, to
+    # interleave another worker's commands with the expired-lease cleanup
+
+    def __init__(self):
+        super().__init__()
+        self.on_drained = None
+
+    def lmove(self, source, destination, source_side='LEFT', destination_side='RIGHT'):
+        value = super().lmove(source, destination, source_side, destination_side)
+        if value is None and ':processing:' in source and self.on_drained:
+            on_drained, self.on_drained = self.on_drained, None
+            on_drained()
+        return value
+
+
+def check_redis_requeue_race():
+    # Worker B requeues the expired lease of worker A. Right after the drain, A leases
+    # again and then crashes: its new lease must still expire and be recovered
+    errors = []
+    client = InterleavingRedis()
+    queue_a = RedisQueue(client, 'race', lease_seconds=LEASE_SECONDS)
+    queue_b = RedisQueue(client, 'race', lease_seconds=LEASE_SECONDS)
+    queue_a.push(['http://example.com/1', 'http://example.com/2', 'http://example.com/3'])
+    queue_a.lease('worker-a', 1)
+    time.sleep(LEASE_SECONDS * 1.5)
+
+    client.on_drained = lambda: queue_a.lease('worker-a', 1)
+    queue_b.complete(queue_b.lease('worker-b', 1))
+    time.sleep(LEASE_SECONDS * 1.5)
+    queue_b.complete(queue_b.lease('worker-b', 5))
+    counts = queue_b.counts()
+    if counts != {'pending': 0, 'leased': 0, 'done': 3, 'failed': 0}:
+        errors.append(f'counts after worker A crashed again: {counts}')
+    return errors
+
+
+if __name__ == "__main__":
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        for spec in [f'sqlite:{os.path.join(directory, "queue.db")}', f'dir:{directory}', 'memory:']:
+            errors = check(spec)
+            print(f'{spec.partition(":")[0]:<8} {"ok" if not errors else "FAILED"}')
+            for error in errors:
+                print(f'  {error}')
+            failed = failed or bool(errors)
+    errors = check_redis_requeue_race()
+    print(f'{"race":<8} {"ok" if not errors else "FAILED"}')
+    for error in errors:
+        print(f'  {error}')
+    failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,115 @@
+from datetime import datetime
+import argparse
+import importlib
+import logging
+import os
+import socket
+import sys
+import time
+
+
+# Only the standard library is imported here; store modules and their HTTP clients
+# are loaded once the arguments are known, so `--help` and bad arguments return instantly
+
+STORES = ['atb', 'metro', 'novus', 'ekomarket']
+MODES = ['full', 'low-memory', 'coordinator', 'worker', 'reparse']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Scrape product prices from a store')
+    parser.add_argument('store', choices=STORES)
+    parser.add_argument('--mode', choices=MODES, default='full',
+                        help='full: scrape the whole sitemap (default); low-memory: bounded-memory scrape; '
+                             'coordinator/worker: distributed crawl over --queue; reparse: rebuild a CSV from --archive')
+    parser.add_argument('--output', help='Output CSV (default: <store><date>.csv, <store><date>_reparsed.csv for reparse)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Scraping threads (default: 5), or processes for reparse (default: one per core)')
+    parser.add_argument('--date', help='Date as in the output filename, e.g. 20241031 (default: today)')
+    parser.add_argument('--budget', type=int, default=None,
+                        help='Scrape at most this many URLs, most volatile first (full mode)')
+    parser.add_argument('--archive', metavar='DIR', help='Archive raw responses under DIR (full mode) or reparse from it')
+    parser.add_argument('--memory-limit-mb', type=float, default=None, help='RSS ceiling (low-memory mode)')
+    parser.add_argument('--queue', help="'sqlite:queue.db', 'dir:/shared/queue' or 'redis://host:6379/0'")
+    parser.add_argument('--characteristic', action='append', metavar='NAME',
+                        help='Extra ATB characteristic to write as its own column; may be repeated (full mode)')
+    parser.add_argument('--force', action='store_true', help='Overwrite an existing output CSV (reparse mode)')
+    args = parser.parse_args(argv)
+    if args.characteristic and args.store != 'atb':
+        parser.error('--characteristic is only available for atb')
+    if args.mode in ('coordinator', 'worker') and not args.queue:
+        parser.error(f'--queue is required in {args.mode} mode')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    current_date = args.date or datetime.now().strftime('%Y%m%d')
+    output_filename = args.output or f'{args.store}{current_date}.csv'
+    max_workers = args.workers or 5
+
+    # Every scraping run feeds the price-volatility statistics; --budget only limits how many URLs are scraped
+    scheduler = None
+    if args.mode in ('full', 'low-memory', 'worker'):
+        from scheduler import VolatilityScheduler
+        scheduler = VolatilityScheduler(args.store)
+
+    start_time = time.time()
+    if args.mode == 'reparse':
+        from archive import reparse
+        # Never replace the scraped CSV by accident
+        output_filename = args.output or f'{args.store}{current_date}_reparsed.csv'
+        if os.path.exists(output_filename) and not args.force:
+            logging.error(f'{output_filename} already exists, pass --force to overwrite it')
+            sys.exit(1)
+        reparse(args.store, current_date, output_filename, args.archive or 'archive', args.workers)
+
+    elif args.mode == 'low-memory':
+        from memory import scrape_all_products_bounded
+        store = importlib.import_module(args.store)
+        completed = scrape_all_products_bounded(
+            store, output_filename, max_workers, args.memory_limit_mb, scheduler=scheduler
+        )
+
+    elif args.mode in ('coordinator', 'worker'):
+        from distributed import coordinate, work
+        from work_queue import open_queue
+        store = importlib.import_module(args.store)
+        # One queue per store and day, so finished URLs of earlier crawls are not skipped
+        queue = open_queue(args.queue, name=f'{args.store}{current_date}')
+        if args.mode == 'coordinator':
+            coordinate(store, queue)
+        else:
+            worker_id = f'{socket.gethostname()}-{os.getpid()}'
+            output_filename = args.output or f'{args.store}{current_date}_{worker_id}.csv'
+            work(store, queue, output_filename, max_workers=max_workers, worker_id=worker_id, scheduler=scheduler)
+        queue.close()
+
+    else:
+        store = importlib.import_module(args.store)
+        archive = None
+        if args.archive:
+            from archive import ArchiveWriter, archive_directory
+            archive = ArchiveWriter(archive_directory(args.store, current_date, args.archive))
+        options = {'characteristic_columns': args.characteristic} if args.characteristic else {}
+        store.scrape_all_products(
+            store.SITEMAP_URL, output_filename, max_workers=max_workers,
+            scheduler=scheduler, budget=args.budget, archive=archive, **options
+        )
+        if archive:
+            archive.close()
+
+    if scheduler:
+        scheduler.close()
+
+    end_time = time.time()
+    logging.info(f'{args.mode.capitalize()} run completed in {end_time - start_time:.2f} seconds')
+
+    # A low-memory run stopped by the RSS ceiling is unfinished; let the caller rerun it
+    if args.mode == 'low-memory' and not completed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+from datetime import datetime
+import argparse
+import csv
+import importlib
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from work_queue import open_queue
+
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def coordinate(store, queue):
+    # Load the store's sitemap URLs into the shared queue; URLs already queued are skipped
+    sitemap_content = store.fetch_sitemap(store.SITEMAP_URL)
+    if sitemap_content:
+        urls = store.parse_sitemap(sitemap_content)
+        added = queue.push(urls)
+        logging.info(f'Queued {added} new URLs out of {len(urls)} in the sitemap')
+
+
+def work(store, queue, output_filename, max_workers=5, batch_size=25, poll_interval=30, worker_id=None,
+         scheduler=None, status_interval=300):
+    # Lease URLs from the queue until it is drained, appending results to this worker's CSV
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+
+    # Initialize the CSV file with headers if starting from scratch
+    if not os.path.exists(output_filename):
+        with open(output_filename, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=store.FIELDNAMES)
+            writer.writeheader()
+
+    scrape_date = datetime.now().strftime('%Y-%m-%d')
+    completed_urls = 0
+    failed_attempts = 0
+    # Queue-wide counts can be slow to gather (DirectoryQueue lists every state directory),
+    # so they are only logged every status_interval seconds; each batch logs this worker's tally
+    last_status = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            urls = queue.lease(worker_id, batch_size)
+            if not urls:
+                counts = queue.counts()
+                if not counts['pending'] and not counts['leased']:
+                    break
+                # Other workers still hold leases; wait in case one of them crashed
+                logging.info(f'Waiting for {counts["leased"]} URLs leased by other workers')
+                time.sleep(poll_interval)
+                continue
+
+            batch_data = []
+            done_urls = []
+            failed_urls = []
+            future_to_url = {executor.submit(store.scrape_product_info, url): url for url in urls}
+            for future in as_completed(future_to_url):
+                url = future_to_url[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logging.error(f'Error scraping {url}: {e}')
+                    data = None
+                if data:
+                    data.scrape_date = scrape_date
+                    batch_data.append(data)
+                    done_urls.append(url)
+                else:
+                    failed_urls.append(url)
+
+            # Results are written before the URLs are marked done, so a crash re-scrapes rather than loses them
+            if batch_data:
+                store.save_batch_data(batch_data, output_filename)
+                if scheduler:
+                    scheduler.observe(batch_data)
+            queue.complete(done_urls)
+            queue.fail(failed_urls)
+            completed_urls += len(done_urls)
+            failed_attempts += len(failed_urls)
+
+            logging.info(f'Worker {worker_id}: {completed_urls} scraped, {failed_attempts} failed attempts')
+            if time.time() - last_status >= status_interval:
+                logging.info(f'Queue {queue.counts()}')
+                last_status = time.time()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Distributed crawl over a shared URL queue')
+    parser.add_argument('role', choices=['coordinator', 'worker'])
+    parser.add_argument('store', choices=['atb', 'metro', 'novus', 'ekomarket'])
+    parser.add_argument('--queue', required=True, help="'sqlite:queue.db', 'dir:/shared/queue' or 'redis://host:6379/0'")
+    parser.add_argument('--output', help='CSV file for this worker (default: <store><date>_<host>-<pid>.csv)')
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--lease-seconds', type=int, default=600)
+    parser.add_argument('--date', help='Run date shared by the coordinator and its workers, e.g. 20241031 (default: today)')
+    args = parser.parse_args()
+
+    store = importlib.import_module(args.store)
+    current_date = args.date or datetime.now().strftime('%Y%m%d')
+    # One queue per store and day, so finished URLs of earlier crawls are not skipped
+    queue = open_queue(args.queue, name=f'{args.store}{current_date}', lease_seconds=args.lease_seconds)
+
+    start_time = time.time()
+    if args.role == 'coordinator':
+        coordinate(store, queue)
+    else:
+        worker_id = f'{socket.gethostname()}-{os.getpid()}'
+        output_filename = args.output or f'{args.store}{current_date}_{worker_id}.csv'
+        work(store, queue, output_filename, max_workers=args.workers, worker_id=worker_id)
+    queue.close()
+    end_time = time.time()
+    logging.info(f'{args.role.capitalize()} completed in {end_time - start_time:.2f} seconds')
@@ -1,17 +1,24 @@
 import requests
 from bs4 import BeautifulSoup
-import pandas as pd
 from datetime import datetime
 import csv
 import logging
 import time
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from product import ProductRecord, Stock, parse_price, parse_weight
 
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+SITEMAP_URL = 'https://eko.zakaz.ua/products-sitemap-uk.xml'
+
+FIELDNAMES = [
+    'url', 'title', 'weight', 'weight_unit', 'stock', 'old_price', 'discounted_price',
+    'unit_price', 'trademark', 'producer', 'origin_country', 'scrape_date'
+]
+
 
 def fetch_sitemap(url):
     try:
@@ -29,7 +36,94 @@ def parse_sitemap(xml_content):
     return urls
 
 
-def scrape_product_info(url):
+def iter_sitemap_urls(url):
+    # Yield the sitemap URLs one at a time without holding the whole document in memory
+    from memory import stream_sitemap
+    return stream_sitemap(requests.get, url)
+
+
+def parse_product_page(url, content):
+    soup = BeautifulSoup(content, 'html.parser')
+    
+    # Extract the title
+    title_element = soup.find('h1', {'data-marker': 'Big Product Cart Title'})
+    title = title_element.get_text().strip() if title_element else None
+
+    # Extract the weight
+    weight_element = soup.find('div', {'data-marker': 'Weight'})
+    weight, weight_unit = parse_weight(weight_element.get_text() if weight_element else None)
+
+    # Extract the stock status
+    stock_element = soup.find('div', {'data-testid': 'stock-balance-label', 'data-marker': 'Stock_balance_label'})
+    stock = Stock.OUT
+    if stock_element:
+        classes = stock_element.get('class', [])
+        if 'BigProductStockBalanceLabel_in_stock' in classes:
+            stock = Stock.IN
+        elif 'BigProductStockBalanceLabel_low_stock' in classes:
+            stock = Stock.LOW
+        elif 'BigProductStockBalanceLabel_running_out' in classes:
+            stock = Stock.VERY_LOW
+
+    # Extract the prices
+    discounted_price_element = soup.find('span', {'data-marker': 'Discounted Price'})
+    discounted_price = discounted_price_element.get_text() if discounted_price_element else None
+
+    old_price_element = soup.find('span', {'data-marker': 'Old Price'})
+    old_price = old_price_element.get_text() if old_price_element else discounted_price
+
+    # Extract the trademark
+    trademark_element = soup.find('li', {'data-marker': 'Taxon tm'})
+    if trademark_element:
+        span_elements = trademark_element.find_all('span')
+        if len(span_elements) > 1:
+            trademark = span_elements[1].get_text()
+        else:
+            trademark = None
+    else:
+        trademark = None
+
+    # Extract the producer
+    producer_element = soup.find('li', {'data-marker': 'Taxon pr'})
+    if producer_element:
+        span_elements = producer_element.find_all('span')
+        if len(span_elements) > 1:
+            producer = span_elements[1].get_text()
+        else:
+            producer = None
+    else:
+        producer = None
+
+    # Extract the origin country
+    origin_country_element = soup.find('li', {'data-marker': 'Taxon country'})
+    if origin_country_element:
+        span_elements = origin_country_element.find_all('span')
+        if len(span_elements) > 1:
+            origin_country = span_elements[1].get_text()
+        else:
+            origin_country = None
+    else:
+        origin_country = None
+
+    # Release the parse tree right away instead of waiting for the garbage collector
+    soup.decompose()
+
+    # Return the normalised product record
+    return ProductRecord(
+        url,
+        title=title,
+        weight=weight,
+        weight_unit=weight_unit,
+        stock=stock,
+        old_price=parse_price(old_price),
+        discounted_price=parse_price(discounted_price),
+        trademark=trademark,
+        producer=producer,
+        origin_country=origin_country
+    )
+
+
+def scrape_product_info(url, archive=None):
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
@@ -41,80 +135,9 @@ def scrape_product_info(url):
         try:
             response = requests.get(url, headers=headers)
             response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Extract the title
-            title_element = soup.find('h1', {'data-marker': 'Big Product Cart Title'})
-            title = title_element.get_text() if title_element else None
-
-            # Extract the weight
-            weight_element = soup.find('div', {'data-marker': 'Weight'})
-            weight = weight_element.get_text() if weight_element else None
-
-            # Extract the stock status
-            stock_element = soup.find('div', {'data-testid': 'stock-balance-label', 'data-marker': 'Stock_balance_label'})
-            stock = 'out'
-            if stock_element:
-                classes = stock_element.get('class', [])
-                if 'BigProductStockBalanceLabel_in_stock' in classes:
-                    stock = 'instock'
-                elif 'BigProductStockBalanceLabel_low_stock' in classes:
-                    stock='low'
-                elif 'BigProductStockBalanceLabel_running_out' in classes:
-                    stock = 'very low'
-
-            # Extract the prices
-            discounted_price_element = soup.find('span', {'data-marker': 'Discounted Price'})
-            discounted_price = discounted_price_element.get_text() if discounted_price_element else None
-
-            old_price_element = soup.find('span', {'data-marker': 'Old Price'})
-            old_price = old_price_element.get_text() if old_price_element else discounted_price
-
-            # Extract the trademark
-            trademark_element = soup.find('li', {'data-marker': 'Taxon tm'})
-            if trademark_element:
-                span_elements = trademark_element.find_all('span')
-                if len(span_elements) > 1:
-                    trademark = span_elements[1].get_text()
-                else:
-                    trademark = None
-            else:
-                trademark = None
-
-            # Extract the producer
-            producer_element = soup.find('li', {'data-marker': 'Taxon pr'})
-            if producer_element:
-                span_elements = producer_element.find_all('span')
-                if len(span_elements) > 1:
-                    producer = span_elements[1].get_text()
-                else:
-                    producer = None
-            else:
-                producer = None
-
-            # Extract the origin country
-            origin_country_element = soup.find('li', {'data-marker': 'Taxon country'})
-            if origin_country_element:
-                span_elements = origin_country_element.find_all('span')
-                if len(span_elements) > 1:
-                    origin_country = span_elements[1].get_text()
-                else:
-                    origin_country = None
-            else:
-                origin_country = None
-
-            # Return the data as a dictionary
-            return {
-                'url': url,
-                'title': title,
-                'weight': weight,
-                'stock': stock,
-                'old_price': old_price,
-                'discounted_price': discounted_price,
-                'trademark': trademark,
-                'producer': producer,
-                'origin_country': origin_country
-            }
+            if archive:
+                archive.write(url, response.content)
+            return parse_product_page(url, response.content)
         except requests.RequestException as e:
             logging.error(f'Attempt {tries} failed to retrieve the page: {url} - {e}')
             if tries == max_tries:
@@ -124,27 +147,25 @@ def scrape_product_info(url):
 
 def get_processed_urls(output_filename):
     if os.path.exists(output_filename):
-        df = pd.read_csv(output_filename)
-        logging.debug(f'Columns in the output file: {df.columns.tolist()}')
-        if 'url' in df.columns:
-            return set(df['url'])
-        else:
-            logging.error(f'url column not found in {output_filename}')
-            return set()
+        with open(output_filename, newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            logging.debug(f'Columns in the output file: {reader.fieldnames}')
+            if reader.fieldnames and 'url' in reader.fieldnames:
+                return {row['url'] for row in reader}
+            else:
+                logging.error(f'url column not found in {output_filename}')
+                return set()
     return set()
 
 
 def save_batch_data(batch_data, output_filename):
     with open(output_filename, mode='a', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=[
-            'url', 'title', 'weight', 'stock', 'old_price', 'discounted_price', 
-            'trademark', 'producer', 'origin_country', 'scrape_date'
-        ])
-        writer.writerows(batch_data)
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES, extrasaction='ignore')
+        writer.writerows(record.as_row() for record in batch_data)
     logging.info(f'Saved a batch of {len(batch_data)} products to {output_filename}')
 
 
-def scrape_all_products(sitemap_url, output_filename, max_workers=5):
+def scrape_all_products(sitemap_url, output_filename, max_workers=5, scheduler=None, budget=None, archive=None):
     sitemap_content = fetch_sitemap(sitemap_url)
     if sitemap_content:
         urls = parse_sitemap(sitemap_content)
@@ -153,6 +174,15 @@ def scrape_all_products(sitemap_url, output_filename, max_workers=5):
         total_urls = len(urls)
         remaining_urls = [url for url in urls if url not in processed_urls]
 
+        # Refresh volatile products first, within the request budget; rows already in
+        # the output file were scraped by an earlier leg of this run and count against it
+        if scheduler:
+            n_remaining = len(remaining_urls)
+            if budget is not None:
+                budget = max(budget - len(processed_urls), 0)
+            remaining_urls = scheduler.order(remaining_urls, budget)
+            total_urls -= n_remaining - len(remaining_urls)
+
         # Record the number of total urls to a separate file (for server running purposes)
         with open("n_rows_ekomarket.txt", 'w') as f:
             f.write(str(total_urls))
@@ -160,17 +190,15 @@ def scrape_all_products(sitemap_url, output_filename, max_workers=5):
         # Initialize the CSV file with headers if starting from scratch
         if not os.path.exists(output_filename):
             with open(output_filename, mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=[
-                    'url', 'title', 'weight', 'stock', 'old_price', 'discounted_price', 
-                    'trademark', 'producer', 'origin_country', 'scrape_date'
-                ])
+                writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
                 writer.writeheader()
 
         batch_size = 25
         batch_data = []
+        scrape_date = datetime.now().strftime('%Y-%m-%d')
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {executor.submit(scrape_product_info, url): url for url in remaining_urls}
+            future_to_url = {executor.submit(scrape_product_info, url, archive): url for url in remaining_urls}
             completed_urls = len(processed_urls)
 
             for future in as_completed(future_to_url):
@@ -178,12 +206,14 @@ def scrape_all_products(sitemap_url, output_filename, max_workers=5):
                 try:
                     data = future.result()
                     if data:
-                        data['scrape_date'] = datetime.now().strftime('%Y-%m-%d')
+                        data.scrape_date = scrape_date
                         batch_data.append(data)
                         processed_urls.add(url)
                         completed_urls += 1
                         if len(batch_data) >= batch_size:
                             save_batch_data(batch_data, output_filename)
+                            if scheduler:
+                                scheduler.observe(batch_data)
                             batch_data.clear()
                     progress = (completed_urls / total_urls) * 100
                     logging.info(f'Progress: {progress:.2f}% ({completed_urls}/{total_urls})')
@@ -193,10 +223,11 @@ def scrape_all_products(sitemap_url, output_filename, max_workers=5):
         # Save any remaining data in the last batch
         if batch_data:
             save_batch_data(batch_data, output_filename)
+            if scheduler:
+                scheduler.observe(batch_data)
 
 
 if __name__ == "__main__":
-    SITEMAP_URL = 'https://eko.zakaz.ua/products-sitemap-uk.xml'
     current_date = datetime.now().strftime('%Y%m%d')
     OUTPUT_FILENAME = f'ekomarket{current_date}.csv'
     
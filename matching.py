@@ -0,0 +1,327 @@
+from datetime import datetime
+import csv
+import logging
+import os
+import re
+import sqlite3
+import time
+from itertools import groupby
+from product import WEIGHT_PATTERN
+
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STORES = ['atb', 'metro', 'novus', 'ekomarket']
+
+# Words that carry no information about which product it is
+STOPWORDS = {'тм', 'та', 'з', 'зі', 'із', 'в', 'у', 'для', 'і', 'й', 'the'}
+
+# Blocks larger than this are split by the second title word before comparing
+MAX_BLOCK_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    store TEXT NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT,
+    norm_title TEXT,
+    brand TEXT,
+    producer TEXT,
+    weight TEXT,
+    weight_unit TEXT,
+    price INTEGER,
+    unit_price INTEGER,
+    scrape_date TEXT,
+    PRIMARY KEY (store, url)
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    block_key TEXT NOT NULL,
+    store TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (block_key, store, url)
+);
+CREATE INDEX IF NOT EXISTS blocks_product ON blocks (store, url);
+'''
+
+
+def normalize_text(text):
+    # Lowercase, unify apostrophes and drop punctuation so titles from different stores line up
+    if not text:
+        return ''
+    text = text.lower().replace('’', "'").replace('ʼ', "'")
+    text = WEIGHT_PATTERN.sub(' ', text)
+    words = re.findall(r"[^\W_]+(?:'[^\W_]+)?", text)
+    return ' '.join(word for word in words if word not in STOPWORDS)
+
+
+def trigrams(text):
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def jaccard(first_grams, second_grams):
+    if not first_grams or not second_grams:
+        return 0.0
+    return len(first_grams & second_grams) / len(first_grams | second_grams)
+
+
+def similarity(first, second):
+    # Jaccard similarity of character trigrams, tolerant to word order and small spelling differences
+    return jaccard(trigrams(first), trigrams(second))
+
+
+def second_word(norm_title):
+    words = norm_title.split()
+    return words[1] if len(words) > 1 else ''
+
+
+def split_block(members):
+    # Split an oversized block into sub-blocks sharing the second title word;
+    # members are tuples with the normalised title at index 2
+    sub_blocks = {}
+    for member in members:
+        sub_blocks.setdefault(second_word(member[2]), []).append(member)
+    return list(sub_blocks.values())
+
+
+def blocking_keys(norm_title, brand, producer, weight, weight_unit):
+    # Only products with the same size and the same trademark, producer or leading title word
+    # are ever compared. Producers get their own key: a store may list the producer's legal
+    # name where another lists the trademark
+    size = f'{weight}{weight_unit}' if weight else 'nosize'
+    keys = set()
+    if brand:
+        keys.add(f'{size}|b:{brand}')
+    if producer:
+        keys.add(f'{size}|p:{producer}')
+    if norm_title:
+        keys.add(f'{size}|t:{norm_title.split()[0]}')
+    return keys
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MatchIndex:
+    def __init__(self, path='matching.db'):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        # Indexes built before producers were stored separately; reloading a CSV fills the column
+        columns = [column for _, column, *_ in self.connection.execute('PRAGMA table_info(products)')]
+        if 'producer' not in columns:
+            self.connection.execute('ALTER TABLE products ADD COLUMN producer TEXT')
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, store, rows):
+        # Upsert the rows of one store's CSV and refresh their blocking keys
+        products = []
+        blocks = []
+        for row in rows:
+            norm_title = normalize_text(row.get('title'))
+            brand = normalize_text(row.get('trademark'))
+            producer = normalize_text(row.get('producer'))
+            weight = row.get('weight') or None
+            weight_unit = row.get('weight_unit') or None
+            price = to_int(row.get('discounted_price')) or to_int(row.get('old_price'))
+            products.append((
+                store, row['url'], row.get('title'), norm_title, brand, producer, weight, weight_unit,
+                price, to_int(row.get('unit_price')), row.get('scrape_date')
+            ))
+            for key in blocking_keys(norm_title, brand, producer, weight, weight_unit):
+                blocks.append((key, store, row['url']))
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM blocks WHERE store = ? AND url = ?', [p[:2] for p in products])
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO products (store, url, title, norm_title, brand, producer, weight, weight_unit, '
+                'price, unit_price, scrape_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', products
+            )
+            self.connection.executemany('INSERT OR IGNORE INTO blocks VALUES (?, ?, ?)', blocks)
+        logging.info(f'Indexed {len(products)} {store} products')
+
+    def load_csv(self, store, filename):
+        with open(filename, newline='', encoding='utf-8') as file:
+            self.update(store, csv.DictReader(file))
+
+    def find_matches(self, store, url, threshold=0.5, scrape_date=None):
+        # Return the best match in every other store as {store: (url, title, price, unit_price, score)}
+        product = self.connection.execute(
+            'SELECT norm_title, brand FROM products WHERE store = ? AND url = ?', (store, url)
+        ).fetchone()
+        if not product:
+            return {}
+        norm_title, brand = product
+        grams = trigrams(norm_title)
+
+        query = '''
+            SELECT p.store, p.url, p.norm_title, p.brand, p.title, p.price, p.unit_price
+            FROM blocks b JOIN products p ON p.store = b.store AND p.url = b.url
+            WHERE b.block_key = ? AND b.store != ?
+        '''
+        params = ()
+        if scrape_date:
+            query += ' AND p.scrape_date = ?'
+            params = (scrape_date,)
+
+        best = {}
+        keys = [key for (key,) in self.connection.execute(
+            'SELECT block_key FROM blocks WHERE store = ? AND url = ?', (store, url)
+        )]
+        for key in keys:
+            candidates = self.connection.execute(query, (key, store) + params).fetchall()
+            if len(candidates) > MAX_BLOCK_SIZE:
+                # Same sub-block as split_block() would put this product in
+                word = second_word(norm_title)
+                candidates = [candidate for candidate in candidates if second_word(candidate[2]) == word]
+                if len(candidates) > MAX_BLOCK_SIZE:
+                    logging.warning(f'Block {key} has {len(candidates)} candidates even after splitting, skipping it')
+                    continue
+            for other_store, other_url, other_title, other_brand, title, price, unit_price in candidates:
+                # Different trademarks are never the same product; producers are not compared,
+                # as one store's producer can be another's trademark
+                if brand and other_brand and brand != other_brand:
+                    continue
+                score = jaccard(grams, trigrams(other_title))
+                if score >= threshold and (other_store not in best or score > best[other_store][4]):
+                    best[other_store] = (other_url, title, price, unit_price, score)
+        return best
+
+    def match_block(self, members, threshold, best):
+        # Score every cross-store pair of one block; members are (store, url, norm_title, brand),
+        # brand being the normalised trademark.
+        # best maps (store, url) to {other_store: (score, other_url)}
+        if len({member[0] for member in members}) < 2:
+            return
+        grams = [trigrams(member[2]) for member in members]
+        sizes = [len(member_grams) for member_grams in grams]
+        for i, (store, url, _, brand) in enumerate(members):
+            for j in range(i + 1, len(members)):
+                other_store, other_url, _, other_brand = members[j]
+                # Different trademarks are never the same product; producers are not compared,
+                # as one store's producer can be another's trademark
+                if other_store == store or (brand and other_brand and brand != other_brand):
+                    continue
+                # Jaccard similarity can never exceed the ratio of the two set sizes
+                if min(sizes[i], sizes[j]) < threshold * max(sizes[i], sizes[j]):
+                    continue
+                common = len(grams[i] & grams[j])
+                score = common / (sizes[i] + sizes[j] - common) if common else 0.0
+                if score < threshold:
+                    continue
+                for key, match_store, match_url in ((store, url), other_store, other_url), ((other_store, other_url), store, url):
+                    matches = best.setdefault(key, {})
+                    if match_store not in matches or score > matches[match_store][0]:
+                        matches[match_store] = (score, match_url)
+
+    def best_matches(self, stores=STORES, threshold=0.5, scrape_date=None):
+        # Match the whole index block by block: one query, and trigrams built once per block member
+        query = '''
+            SELECT b.block_key, p.store, p.url, p.norm_title, p.brand
+            FROM blocks b JOIN products p ON p.store = b.store AND p.url = b.url
+        '''
+        params = ()
+        if scrape_date:
+            query += ' WHERE p.scrape_date = ?'
+            params = (scrape_date,)
+        query += ' ORDER BY b.block_key'
+
+        best = {}
+        n_split = 0
+        n_skipped = 0
+        n_skipped_products = 0
+        for key, rows in groupby(self.connection.execute(query, params), key=lambda row: row[0]):
+            members = [row[1:] for row in rows if row[1] in stores]
+            if len(members) <= MAX_BLOCK_SIZE:
+                self.match_block(members, threshold, best)
+                continue
+            n_split += 1
+            for sub_block in split_block(members):
+                if len(sub_block) > MAX_BLOCK_SIZE:
+                    n_skipped += 1
+                    n_skipped_products += len(sub_block)
+                    continue
+                self.match_block(sub_block, threshold, best)
+
+        if n_split:
+            logging.info(f'Split {n_split} blocks over {MAX_BLOCK_SIZE} products by the second title word')
+        if n_skipped:
+            logging.warning(f'Skipped {n_skipped} blocks ({n_skipped_products} products) still over {MAX_BLOCK_SIZE} products after splitting')
+        return best
+
+    def export_comparison(self, output_filename, stores=STORES, threshold=0.5, scrape_date=None):
+        # Write one row per product found in at least two stores, with every store's price side by side
+        best = self.best_matches(stores, threshold, scrape_date)
+
+        query = 'SELECT store, url, title, weight, weight_unit, price, unit_price FROM products'
+        params = ()
+        if scrape_date:
+            query += ' WHERE scrape_date = ?'
+            params = (scrape_date,)
+        products = {}
+        for store, url, *details in self.connection.execute(query, params):
+            if store in stores:
+                products.setdefault(store, {})[url] = details
+
+        fieldnames = ['title', 'weight', 'weight_unit']
+        for store in stores:
+            fieldnames += [f'{store}_url', f'{store}_price', f'{store}_unit_price']
+        fieldnames += ['cheapest_store', 'match_score']
+
+        seen = set()
+        n_rows = 0
+        with open(output_filename, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            for store in stores:
+                for url, (title, weight, weight_unit, price, unit_price) in products.get(store, {}).items():
+                    if (store, url) in seen:
+                        continue
+                    matches = {
+                        other_store: (other_url, score)
+                        for other_store, (score, other_url) in best.get((store, url), {}).items()
+                        if (other_store, other_url) not in seen
+                    }
+                    if not matches:
+                        continue
+                    matches[store] = (url, 1.0)
+
+                    row = {'title': title, 'weight': weight, 'weight_unit': weight_unit}
+                    prices = {}
+                    for match_store, (match_url, _) in matches.items():
+                        seen.add((match_store, match_url))
+                        _, _, _, match_price, match_unit_price = products[match_store][match_url]
+                        row[f'{match_store}_url'] = match_url
+                        row[f'{match_store}_price'] = match_price
+                        row[f'{match_store}_unit_price'] = match_unit_price
+                        if match_price is not None:
+                            prices[match_store] = match_price
+                    row['cheapest_store'] = min(prices, key=prices.get) if prices else None
+                    row['match_score'] = f'{min(score for _, score in matches.values()):.2f}'
+                    writer.writerow(row)
+                    n_rows += 1
+        logging.info(f'Saved {n_rows} matched products to {output_filename}')
+
+
+if __name__ == "__main__":
+    current_date = datetime.now().strftime('%Y%m%d')
+    OUTPUT_FILENAME = f'comparison{current_date}.csv'
+
+    start_time = time.time()
+    index = MatchIndex()
+    for store in STORES:
+        filename = f'{store}{current_date}.csv'
+        if os.path.exists(filename):
+            index.load_csv(store, filename)
+        else:
+            logging.error(f'{filename} not found, skipping {store}')
+    index.export_comparison(OUTPUT_FILENAME, scrape_date=datetime.now().strftime('%Y-%m-%d'))
+    index.close()
+    end_time = time.time()
+    logging.info(f'Matching completed in {end_time - start_time:.2f} seconds')
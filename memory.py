@@ -0,0 +1,252 @@
+from array import array
+from datetime import datetime
+import argparse
+import csv
+import gc
+import hashlib
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def current_rss_mb():
+    # Resident set size right now, or None where /proc is not available
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class CompactUrlSet:
+    # Set of URLs stored as 64-bit hashes in an open-addressing array: about 16 bytes
+    # per URL instead of the 150+ a set of strings takes
+
+    def __init__(self, capacity=1024):
+        self.slots = array('Q', bytes(8 * capacity))
+        self.size = 0
+
+    @staticmethod
+    def _hash(url):
+        # Zero marks an empty slot, so it is never a valid hash
+        return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    def _probe(self, slots, value):
+        mask = len(slots) - 1
+        index = value & mask
+        while slots[index] and slots[index] != value:
+            index = (index + 1) & mask
+        return index
+
+    def add(self, url):
+        value = self._hash(url)
+        index = self._probe(self.slots, value)
+        if self.slots[index]:
+            return
+        self.slots[index] = value
+        self.size += 1
+        if self.size * 2 > len(self.slots):
+            slots = array('Q', bytes(16 * len(self.slots)))
+            for old_value in self.slots:
+                if old_value:
+                    slots[self._probe(slots, old_value)] = old_value
+            self.slots = slots
+
+    def __contains__(self, url):
+        value = self._hash(url)
+        return self.slots[self._probe(self.slots, value)] == value
+
+    def __len__(self):
+        return self.size
+
+
+def load_processed_urls(output_filename):
+    # Stream the url column of the resume file into a CompactUrlSet
+    processed_urls = CompactUrlSet()
+    if os.path.exists(output_filename):
+        with open(output_filename, newline='', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            header = next(reader, [])
+            if 'url' not in header:
+                logging.error(f'url column not found in {output_filename}')
+                return processed_urls
+            url_column = header.index('url')
+            for row in reader:
+                if len(row) > url_column:
+                    processed_urls.add(row[url_column])
+    return processed_urls
+
+
+def stream_sitemap_urls(file):
+    # Yield <loc> entries one at a time, discarding every <url> element once read
+    root = None
+    for event, element in ET.iterparse(file, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event != 'end':
+            continue
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'loc' and element.text:
+            yield element.text.strip()
+        elif tag == 'url':
+            root.clear()
+
+
+def stream_sitemap(get, url):
+    # Spool the sitemap to a temporary file instead of memory, then yield its URLs.
+    # Spooling also avoids holding the HTTP connection open for the whole crawl
+    with tempfile.TemporaryFile() as file:
+        try:
+            with get(url, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    file.write(chunk)
+        except requests.RequestException as e:
+            logging.error(f'Failed to retrieve the sitemap: {e}')
+            return
+        file.seek(0)
+        yield from stream_sitemap_urls(file)
+
+
+def scrape_all_products_bounded(store, output_filename, max_workers=5, memory_limit_mb=None, max_in_flight=None,
+                                scheduler=None):
+    # Low-memory variant of scrape_all_products: URLs are streamed from the sitemap,
+    # at most max_in_flight pages are pending at once, and no new work is started
+    # while the process is above memory_limit_mb
+    store_name = store.__name__
+    max_in_flight = max_in_flight or max_workers * 2
+    if memory_limit_mb and current_rss_mb() is None:
+        logging.warning('Current RSS is not available on this platform, the memory limit is not enforced')
+
+    processed_urls = load_processed_urls(output_filename)
+    completed_urls = len(processed_urls)
+
+    # Initialize the CSV file with headers if starting from scratch
+    if not os.path.exists(output_filename):
+        with open(output_filename, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=store.FIELDNAMES)
+            writer.writeheader()
+
+    batch_size = 25
+    batch_data = []
+    scrape_date = datetime.now().strftime('%Y-%m-%d')
+    total_urls = 0
+    pending = {}
+    urls = store.iter_sitemap_urls(store.SITEMAP_URL)
+    sitemap_done = False
+    throttled = False
+    stopped = False
+
+    def over_limit():
+        rss = current_rss_mb()
+        return memory_limit_mb is not None and rss is not None and rss > memory_limit_mb
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Top up the in-flight queue from the sitemap stream
+            while not sitemap_done and not throttled and len(pending) < max_in_flight:
+                url = next(urls, None)
+                if url is None:
+                    sitemap_done = True
+                    # Record the number of total urls to a separate file (for server running purposes)
+                    with open(f'n_rows_{store_name}.txt', 'w') as f:
+                        f.write(str(total_urls))
+                    break
+                total_urls += 1
+                if url in processed_urls:
+                    continue
+                pending[executor.submit(store.scrape_product_info, url)] = url
+
+            if not pending:
+                if throttled:
+                    logging.error(f'RSS still above {memory_limit_mb} MB with no pages in flight, stopping; rerun to resume')
+                    stopped = True
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                try:
+                    data = future.result()
+                    if data:
+                        data.scrape_date = scrape_date
+                        batch_data.append(data)
+                        processed_urls.add(url)
+                        completed_urls += 1
+                        if len(batch_data) >= batch_size:
+                            store.save_batch_data(batch_data, output_filename)
+                            if scheduler:
+                                scheduler.observe(batch_data)
+                            batch_data.clear()
+                    logging.info(f'Progress: {completed_urls} scraped ({total_urls} URLs read from the sitemap)')
+                except Exception as e:
+                    logging.error(f'Error scraping {url}: {e}')
+
+            # Above the ceiling: flush buffered rows and collect garbage, and if that is not
+            # enough, stop starting new pages until the in-flight ones have finished
+            throttled = False
+            if over_limit():
+                if batch_data:
+                    store.save_batch_data(batch_data, output_filename)
+                    if scheduler:
+                        scheduler.observe(batch_data)
+                    batch_data.clear()
+                gc.collect()
+                throttled = over_limit()
+                if throttled:
+                    logging.warning(f'RSS above {memory_limit_mb} MB, pausing new pages')
+
+    # Save any remaining data in the last batch
+    if batch_data:
+        store.save_batch_data(batch_data, output_filename)
+        if scheduler:
+            scheduler.observe(batch_data)
+
+    peak = peak_rss_mb()
+    if peak is not None:
+        logging.info(f'Peak RSS: {peak:.1f} MB')
+    return not stopped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scrape a store with bounded memory use')
+    parser.add_argument('store', choices=['atb', 'metro', 'novus', 'ekomarket'])
+    parser.add_argument('--output', help='Output CSV (default: <store><date>.csv)')
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--memory-limit-mb', type=float, default=None)
+    args = parser.parse_args()
+
+    store = importlib.import_module(args.store)
+    current_date = datetime.now().strftime('%Y%m%d')
+
+    start_time = time.time()
+    completed = scrape_all_products_bounded(
+        store, args.output or f'{args.store}{current_date}.csv', args.workers, args.memory_limit_mb
+    )
+    end_time = time.time()
+    logging.info(f'Scraping completed in {end_time - start_time:.2f} seconds')
+    if not completed:
+        sys.exit(1)
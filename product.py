@@ -0,0 +1,125 @@
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+import re
+
+
+# Unified stock status across stores
+class Stock(Enum):
+    IN = 'in'
+    LOW = 'low'
+    VERY_LOW = 'very low'
+    OUT = 'out'
+
+
+# Weight/volume units mapped to (multiplier, base unit)
+WEIGHT_UNITS = {
+    'г': (1, 'g'),
+    'гр': (1, 'g'),
+    'g': (1, 'g'),
+    'кг': (1000, 'g'),
+    'kg': (1000, 'g'),
+    'мл': (1, 'ml'),
+    'ml': (1, 'ml'),
+    'л': (1000, 'ml'),
+    'l': (1000, 'ml'),
+    'шт': (1, 'pcs'),
+    'pcs': (1, 'pcs'),
+}
+
+# Matches e.g. "500 г", "1,5 кг", "0.33л" and multipacks such as "4 x 100 г"
+WEIGHT_PATTERN = re.compile(
+    r'(?:(\d+)\s*[xх×]\s*)?(\d+(?:[.,]\d+)?)\s*(кг|гр|г|мл|л|шт|kg|g|ml|l|pcs)(?![^\W\d_])',
+    re.IGNORECASE
+)
+PRICE_PATTERN = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+def parse_price(text):
+    # Convert a price such as "1 052,90 грн" to integer kopecks
+    if not text:
+        return None
+    match = PRICE_PATTERN.search(re.sub(r'\s', '', text))
+    if not match:
+        return None
+    try:
+        return int(Decimal(match.group().replace(',', '.')) * 100)
+    except InvalidOperation:
+        return None
+
+
+def parse_weight(text):
+    # Convert a weight or volume such as "1,5 кг" to (amount in g/ml/pcs, unit)
+    if not text:
+        return None, None
+    match = WEIGHT_PATTERN.search(text)
+    if not match:
+        return None, None
+    count, amount, unit = match.groups()
+    multiplier, base_unit = WEIGHT_UNITS[unit.lower()]
+    amount = Decimal(amount.replace(',', '.')) * multiplier * int(count or 1)
+    return (int(amount) if amount == amount.to_integral_value() else float(amount)), base_unit
+
+
+class ProductRecord:
+    # Slots keep buffered rows small; values are normalised when the record is built
+    __slots__ = (
+        'url', 'title', 'weight', 'weight_unit', 'stock', 'old_price', 'discounted_price',
+        'price_unit', 'trademark', 'producer', 'origin_country', 'characteristics', 'scrape_date'
+    )
+
+    def __init__(self, url: str, title: str = None, weight: float = None, weight_unit: str = None,
+                 stock: Stock = Stock.OUT, old_price: int = None, discounted_price: int = None,
+                 price_unit: str = None, trademark: str = None, producer: str = None,
+                 origin_country: str = None, characteristics: dict = None, scrape_date: str = None):
+        self.url = url
+        self.title = title
+        self.weight = weight
+        self.weight_unit = weight_unit
+        self.stock = stock
+        self.old_price = old_price
+        self.discounted_price = discounted_price
+        self.price_unit = price_unit
+        self.trademark = trademark
+        self.producer = producer
+        self.origin_country = origin_country
+        self.characteristics = characteristics
+        self.scrape_date = scrape_date
+
+    @property
+    def price(self):
+        # The price a customer pays today, in kopecks
+        return self.discounted_price if self.discounted_price is not None else self.old_price
+
+    @property
+    def unit_price(self):
+        # Price in kopecks per kg, per litre or per piece
+        price = self.price
+        if price is None:
+            return None
+        if self.price_unit == 'кг':
+            return price
+        if not self.weight:
+            return None
+        if self.weight_unit in ('g', 'ml'):
+            return round(price * 1000 / self.weight)
+        return round(price / self.weight)
+
+    def as_row(self):
+        return {
+            'url': self.url,
+            'title': self.title,
+            'weight': self.weight,
+            'weight_unit': self.weight_unit,
+            'stock': self.stock.value,
+            'old_price': self.old_price,
+            'discounted_price': self.discounted_price,
+            'unit_price': self.unit_price,
+            'price_unit': self.price_unit,
+            'trademark': self.trademark,
+            'producer': self.producer,
+            'origin_country': self.origin_country,
+            'scrape_date': self.scrape_date,
+        }
+
+    def __repr__(self):
+        return f'ProductRecord({self.url!r}, price={self.price}, stock={self.stock.value!r})'
@@ -0,0 +1,120 @@
+from datetime import datetime, date
+import logging
+import sqlite3
+
+
+# Promotions seen within this many days make a product more likely to change again soon
+PROMO_WINDOW_DAYS = 14
+PROMO_BOOST = 2.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS url_stats (
+    store TEXT NOT NULL,
+    url TEXT NOT NULL,
+    observations INTEGER NOT NULL DEFAULT 0,
+    price_changes INTEGER NOT NULL DEFAULT 0,
+    stock_changes INTEGER NOT NULL DEFAULT 0,
+    last_price INTEGER,
+    last_stock TEXT,
+    last_seen TEXT,
+    last_change TEXT,
+    last_promo TEXT,
+    PRIMARY KEY (store, url)
+)
+'''
+
+
+def days_between(earlier, later):
+    return (later - date.fromisoformat(earlier)).days if earlier else 0
+
+
+class VolatilityScheduler:
+    # Keeps per-URL change statistics across runs and orders the crawl so that
+    # products whose price or stock change often are refreshed first
+
+    def __init__(self, store, path='schedule.db'):
+        self.store = store
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def observe(self, records):
+        # Update the statistics with a batch of freshly scraped ProductRecords. Callers save the
+        # batch first; schedule.db is shared by every run in the directory, so a locked or broken
+        # database is logged and skipped rather than raised into the scraping loop
+        try:
+            self.update(records)
+        except Exception as e:
+            logging.error(f'Could not update the volatility statistics for {len(records)} products: {e}')
+
+    def update(self, records):
+        with self.connection:
+            for record in records:
+                scrape_date = record.scrape_date or datetime.now().strftime('%Y-%m-%d')
+                stock = record.stock.value
+                on_promo = (
+                    record.discounted_price is not None and record.old_price is not None
+                    and record.discounted_price < record.old_price
+                )
+                row = self.connection.execute(
+                    'SELECT last_price, last_stock, last_change, last_promo FROM url_stats WHERE store = ? AND url = ?',
+                    (self.store, record.url)
+                ).fetchone()
+                if row is None:
+                    self.connection.execute(
+                        'INSERT INTO url_stats (store, url, observations, last_price, last_stock, last_seen, last_promo) '
+                        'VALUES (?, ?, 1, ?, ?, ?, ?)',
+                        (self.store, record.url, record.price, stock, scrape_date, scrape_date if on_promo else None)
+                    )
+                    continue
+
+                last_price, last_stock, last_change, last_promo = row
+                price_changed = record.price != last_price
+                stock_changed = stock != last_stock
+                self.connection.execute(
+                    'UPDATE url_stats SET observations = observations + 1, price_changes = price_changes + ?, '
+                    'stock_changes = stock_changes + ?, last_price = ?, last_stock = ?, last_seen = ?, '
+                    'last_change = ?, last_promo = ? WHERE store = ? AND url = ?',
+                    (
+                        int(price_changed), int(stock_changed), record.price, stock, scrape_date,
+                        scrape_date if price_changed or stock_changed else last_change,
+                        scrape_date if on_promo else last_promo,
+                        self.store, record.url
+                    )
+                )
+
+    def priority(self, stats, today):
+        # Expected number of changes missed since the last visit
+        observations, price_changes, stock_changes, last_seen, last_promo = stats
+        change_rate = (price_changes + stock_changes + 1) / (observations + 2)
+        priority = change_rate * max(days_between(last_seen, today), 1)
+        if last_promo and days_between(last_promo, today) <= PROMO_WINDOW_DAYS:
+            priority *= PROMO_BOOST
+        return priority
+
+    def order(self, urls, budget=None, today=None):
+        # Return the URLs most likely to have changed first, cut to the request budget.
+        # URLs never seen before come first; stable products rise as they go stale
+        today = today or date.today()
+        try:
+            stats = {
+                url: row for url, *row in self.connection.execute(
+                    'SELECT url, observations, price_changes, stock_changes, last_seen, last_promo '
+                    'FROM url_stats WHERE store = ?', (self.store,)
+                )
+            }
+        except Exception as e:
+            # Without statistics every URL counts as new and the sitemap order is kept
+            logging.error(f'Could not read the volatility statistics: {e}')
+            stats = {}
+        ordered = sorted(
+            urls,
+            key=lambda url: self.priority(stats[url], today) if url in stats else float('inf'),
+            reverse=True
+        )
+        if budget is not None and len(ordered) > budget:
+            logging.info(f'Scheduling {budget} of {len(ordered)} URLs by price volatility')
+            ordered = ordered[:budget]
+        return ordered
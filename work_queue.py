@@ -0,0 +1,430 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+# Work queues shared by the coordinator and the workers of a distributed crawl.
+# Every backend hands out URLs under a time-limited lease: a URL leased by a worker
+# that crashes goes back to the queue once the lease expires, and is given up on
+# after max_attempts leases.
+#
+# A queue is scoped to one run by its name (e.g. 'metro20241031'): done and failed
+# URLs are only skipped within that run, so the next day's crawl starts fresh.
+
+
+def check_name(name):
+    # The name ends up in SQL table names, directory names and Redis keys
+    if not re.fullmatch(r'\w+', name):
+        raise ValueError(f'Invalid queue name: {name!r}')
+    return name
+
+
+# Remove a worker's lease deadline only if it is still the expired one (ARGV[2] is now)
+REDIS_CLAIM_EXPIRED = '''
+local deadline = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if deadline and tonumber(deadline) <= tonumber(ARGV[2]) then
+    return redis.call('ZREM', KEYS[1], ARGV[1])
+end
+return 0
+'''
+
+
+class SQLiteQueue:
+    # One SQLite file, for workers on the same machine or on a shared local disk
+
+    def __init__(self, path, name='prices_scraper', lease_seconds=600, max_attempts=3):
+        self.table = f'queue_{check_name(name)}'
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                url TEXT PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self.connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_state ON {self.table} (state, lease_until)')
+
+    def push(self, urls):
+        before = self.connection.total_changes
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.executemany(f'INSERT OR IGNORE INTO {self.table} (url) VALUES (?)', ((url,) for url in urls))
+        self.connection.execute('COMMIT')
+        return self.connection.total_changes - before
+
+    def lease(self, worker_id, n):
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.connection.execute(
+                f"UPDATE {self.table} SET state = 'failed' WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            )
+            urls = [url for (url,) in self.connection.execute(
+                f"SELECT url FROM {self.table} WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) LIMIT ?",
+                (now, n)
+            )]
+            self.connection.executemany(
+                f"UPDATE {self.table} SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE url = ?",
+                ((worker_id, now + self.lease_seconds, url) for url in urls)
+            )
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+        return urls
+
+    def complete(self, urls):
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.executemany(f"UPDATE {self.table} SET state = 'done' WHERE url = ?", ((url,) for url in urls))
+        self.connection.execute('COMMIT')
+
+    def fail(self, urls):
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.executemany(
+            f"UPDATE {self.table} SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END WHERE url = ?",
+            ((self.max_attempts, url) for url in urls)
+        )
+        self.connection.execute('COMMIT')
+
+    def counts(self):
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(self.connection.execute(f'SELECT state, COUNT(*) FROM {self.table} GROUP BY state'))
+        return counts
+
+    def close(self):
+        self.connection.close()
+
+
+class DirectoryQueue:
+    # One file per URL moved between state directories; renames are atomic, so any
+    # filesystem shared by the workers (including NFS) can hold the queue
+
+    STATES = ('pending', 'leased', 'done', 'failed')
+
+    def __init__(self, path, name='prices_scraper', lease_seconds=600, max_attempts=3):
+        self.path = os.path.join(path, check_name(name))
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for state in self.STATES:
+            os.makedirs(os.path.join(self.path, state), exist_ok=True)
+
+    def _file(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    def _read(self, filename):
+        with open(filename, encoding='utf-8') as file:
+            url, attempts = file.read().split('\n')
+        return url, int(attempts)
+
+    def _write(self, filename, url, attempts):
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(f'{url}\n{attempts}')
+
+    def _move(self, name, source, target):
+        try:
+            os.rename(self._file(source, name), self._file(target, name))
+            return True
+        except FileNotFoundError:
+            # Another worker got there first
+            return False
+
+    def push(self, urls):
+        added = 0
+        for url in urls:
+            name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+            if any(os.path.exists(self._file(state, name)) for state in self.STATES):
+                continue
+            temp_filename = os.path.join(self.path, f'{name}.{os.getpid()}.tmp')
+            self._write(temp_filename, url, 0)
+            os.replace(temp_filename, self._file('pending', name))
+            added += 1
+        return added
+
+    def _requeue_expired(self):
+        deadline = time.time() - self.lease_seconds
+        for entry in os.scandir(os.path.join(self.path, 'leased')):
+            try:
+                if entry.stat().st_mtime >= deadline:
+                    continue
+                _, attempts = self._read(entry.path)
+            except (FileNotFoundError, ValueError):
+                continue
+            self._move(entry.name, 'leased', 'failed' if attempts >= self.max_attempts else 'pending')
+
+    def lease(self, worker_id, n):
+        self._requeue_expired()
+        urls = []
+        for entry in os.scandir(os.path.join(self.path, 'pending')):
+            if len(urls) >= n:
+                break
+            # Refresh the lease clock before the move, since rename keeps the modification time
+            try:
+                os.utime(entry.path)
+            except FileNotFoundError:
+                continue
+            if not self._move(entry.name, 'pending', 'leased'):
+                continue
+            leased_filename = self._file('leased', entry.name)
+            url, attempts = self._read(leased_filename)
+            self._write(leased_filename, url, attempts + 1)
+            urls.append(url)
+        return urls
+
+    def complete(self, urls):
+        for url in urls:
+            self._move(hashlib.sha1(url.encode('utf-8')).hexdigest(), 'leased', 'done')
+
+    def fail(self, urls):
+        for url in urls:
+            name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+            try:
+                _, attempts = self._read(self._file('leased', name))
+            except (FileNotFoundError, ValueError):
+                continue
+            self._move(name, 'leased', 'failed' if attempts >= self.max_attempts else 'pending')
+
+    def counts(self):
+        return {state: len(os.listdir(os.path.join(self.path, state))) for state in self.STATES}
+
+    def close(self):
+        pass
+
+
+class RedisQueue:
+    # Redis lists and sets, for workers on different machines. Any client object with the
+    # redis-py method names, such as MemoryRedis below, can be passed instead of a URL.
+    #
+    # A leased URL is moved with LMOVE from the pending list onto the worker's own
+    # processing list, so it is always on one list or the other. Workers record a lease
+    # deadline each time they lease; once a worker's deadline has passed, another worker
+    # claims it by removing the deadline, but only if it has not been renewed since, and
+    # then moves its processing list back to pending one LMOVE at a time. Completing or
+    # failing a URL removes it from the processing list and records the outcome in one
+    # transaction.
+
+    def __init__(self, client, name='prices_scraper', lease_seconds=600, max_attempts=3):
+        if isinstance(client, str):
+            try:
+                import redis
+            except ImportError:
+                raise ImportError('The redis package is required for redis:// queues (pip install redis)')
+            client = redis.Redis.from_url(client)
+        self.client = client
+        self.name = check_name(name)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.keys = {key: f'{name}:{key}' for key in ('seen', 'pending', 'workers', 'attempts', 'done', 'failed')}
+        self.worker_id = None
+
+    @staticmethod
+    def _decode(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def _processing(self, worker_id):
+        return f'{self.name}:processing:{worker_id}'
+
+    def _requeue_expired(self, now):
+        for worker_id in self.client.zrangebyscore(self.keys['workers'], 0, now):
+            worker_id = self._decode(worker_id)
+            # A worker that leased again in the meantime has a fresh deadline and is left alone.
+            # If it renews after the claim, its new deadline keeps whatever it takes next
+            # recoverable; at worst a URL it is scraping is also requeued and scraped twice
+            if not self.client.eval(REDIS_CLAIM_EXPIRED, 1, self.keys['workers'], worker_id, now):
+                continue
+            processing = self._processing(worker_id)
+            while self.client.lmove(processing, self.keys['pending'], 'RIGHT', 'LEFT') is not None:
+                pass
+
+    def push(self, urls):
+        added = 0
+        for url in urls:
+            if self.client.sadd(self.keys['seen'], url):
+                self.client.rpush(self.keys['pending'], url)
+                added += 1
+        return added
+
+    def lease(self, worker_id, n):
+        now = time.time()
+        self.worker_id = worker_id
+        self._requeue_expired(now)
+
+        # Record the deadline before taking any URL, so whatever this worker takes can be recovered
+        self.client.zadd(self.keys['workers'], {worker_id: now + self.lease_seconds})
+        processing = self._processing(worker_id)
+        urls = []
+        while len(urls) < n:
+            url = self.client.lmove(self.keys['pending'], processing, 'LEFT', 'RIGHT')
+            if url is None:
+                break
+            url = self._decode(url)
+            if self.client.hincrby(self.keys['attempts'], url, 1) > self.max_attempts:
+                self._finish([url], 'failed')
+                continue
+            urls.append(url)
+        return urls
+
+    def _finish(self, urls, target):
+        pipeline = self.client.pipeline(transaction=True)
+        processing = self._processing(self.worker_id)
+        for url in urls:
+            pipeline.lrem(processing, 1, url)
+            if target == 'pending':
+                pipeline.rpush(self.keys['pending'], url)
+            else:
+                pipeline.sadd(self.keys[target], url)
+        pipeline.execute()
+
+    def complete(self, urls):
+        if urls:
+            self._finish(urls, 'done')
+
+    def fail(self, urls):
+        # URLs out of attempts are moved to failed the next time they are leased
+        if urls:
+            self._finish(urls, 'pending')
+
+    def counts(self):
+        workers = [self._decode(worker_id) for worker_id in self.client.zrangebyscore(self.keys['workers'], 0, '+inf')]
+        return {
+            'pending': self.client.llen(self.keys['pending']),
+            'leased': sum(self.client.llen(self._processing(worker_id)) for worker_id in workers),
+            'done': self.client.scard(self.keys['done']),
+            'failed': self.client.scard(self.keys['failed']),
+        }
+
+    def close(self):
+        pass
+
+
+class MemoryRedis:
+    # In-process stand-in for a Redis server implementing the commands and scripts RedisQueue uses.
+    # Every command runs under one lock and a pipeline runs all its commands at once,
+    # so it behaves like a single Redis server shared by worker threads
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def _get(self, key, factory):
+        return self.data.setdefault(key, factory())
+
+    def sadd(self, key, value):
+        with self.lock:
+            members = self._get(key, set)
+            if value in members:
+                return 0
+            members.add(value)
+            return 1
+
+    def scard(self, key):
+        with self.lock:
+            return len(self.data.get(key, ()))
+
+    def rpush(self, key, value):
+        with self.lock:
+            items = self._get(key, list)
+            items.append(value)
+            return len(items)
+
+    def llen(self, key):
+        with self.lock:
+            return len(self.data.get(key, ()))
+
+    def lrem(self, key, count, value):
+        with self.lock:
+            items = self.data.get(key, [])
+            if value in items:
+                items.remove(value)
+                return 1
+            return 0
+
+    def lmove(self, source, destination, source_side='LEFT', destination_side='RIGHT'):
+        with self.lock:
+            items = self.data.get(source)
+            if not items:
+                return None
+            value = items.pop(0 if source_side == 'LEFT' else -1)
+            target = self._get(destination, list)
+            if destination_side == 'LEFT':
+                target.insert(0, value)
+            else:
+                target.append(value)
+            return value
+
+    def zadd(self, key, mapping):
+        with self.lock:
+            self._get(key, dict).update(mapping)
+            return len(mapping)
+
+    def zrem(self, key, value):
+        with self.lock:
+            return int(self.data.get(key, {}).pop(value, None) is not None)
+
+    def zscore(self, key, value):
+        with self.lock:
+            return self.data.get(key, {}).get(value)
+
+    def zrangebyscore(self, key, minimum, maximum):
+        with self.lock:
+            scores = self.data.get(key, {})
+            minimum, maximum = float(minimum), float(maximum)
+            return sorted((value for value, score in scores.items() if minimum <= score <= maximum), key=scores.get)
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            fields = self._get(key, dict)
+            fields[field] = fields.get(field, 0) + amount
+            return fields[field]
+
+    def eval(self, script, numkeys, *keys_and_args):
+        # Only the scripts RedisQueue runs are known, implemented in Python
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        if script == REDIS_CLAIM_EXPIRED:
+            with self.lock:
+                deadline = self.zscore(keys[0], args[0])
+                if deadline is not None and deadline <= float(args[1]):
+                    return self.zrem(keys[0], args[0])
+                return 0
+        raise NotImplementedError('Unknown script')
+
+    def pipeline(self, transaction=True):
+        return MemoryRedisPipeline(self)
+
+
+class MemoryRedisPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, command):
+        def queue_command(*args):
+            self.commands.append((command, args))
+            return self
+        return queue_command
+
+    def execute(self):
+        with self.client.lock:
+            results = [getattr(self.client, command)(*args) for command, args in self.commands]
+        self.commands = []
+        return results
+
+
+def open_queue(spec, name='prices_scraper', lease_seconds=600, max_attempts=3):
+    # 'sqlite:queue.db', 'dir:/shared/queue', 'redis://host:6379/0' or 'memory:' (in-process, for checks)
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisQueue(spec, name, lease_seconds, max_attempts)
+    backend, _, path = spec.partition(':')
+    if backend == 'memory':
+        return RedisQueue(MemoryRedis(), name, lease_seconds, max_attempts)
+    if backend == 'sqlite':
+        return SQLiteQueue(path, name, lease_seconds, max_attempts)
+    if backend == 'dir':
+        return DirectoryQueue(path, name, lease_seconds, max_attempts)
+    raise ValueError(f'Unknown queue backend: {spec}')